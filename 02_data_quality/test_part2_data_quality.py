@@ -0,0 +1,33 @@
+"""
+Behaviour tests for the Part 2 validation checks on a small CSV dataset.
+
+Run from the repository root or this folder:
+    pytest 02_data_quality -v
+"""
+import pytest
+
+from part2_data_quality import load_data, referential_integrity_checks
+
+CSVS = {
+    "sellers.csv": "seller_id,seller_name,market,am_id\n1,Alpha,AFRQ,10\n2,Beta,GCC,\n",
+    "credits.csv": "credit_id,seller_id,amount,status\n101,1,500,approved\n102,,250,approved\n103,9,100,paid\n",
+    "leads.csv": "lead_id,seller_id,status\n1,1,confirmed\n",
+    "invoices.csv": "invoice_id,seller_id,total\nI1,1,10.0\n",
+    "account_managers.csv": "am_id,am_name\n10,Ann\n",
+}
+
+
+@pytest.fixture
+def data(tmp_path):
+    """Loaded dataset with one credit and one seller carrying a null FK key."""
+    for name, text in CSVS.items():
+        (tmp_path / name).write_text(text, encoding="utf-8")
+    return load_data(tmp_path)
+
+
+def test_orphan_with_null_key_keeps_description(data):
+    """Test: a missing FK key is reported as "nan", not as an empty description."""
+    descs = {(entity, issue, str(rid)): desc for entity, issue, rid, _, desc in referential_integrity_checks(data)}
+    assert descs[("credits", "invalid_seller_id", "102")] == "seller_id nan not found"
+    assert descs[("credits", "invalid_seller_id", "103")] == "seller_id 9.0 not found"
+    assert descs[("sellers", "invalid_am_id", "2")] == "am_id nan not found"
@@ -27,15 +27,20 @@
 #   python part3_etl_pipeline.py --db exam_database.db --input sellers.csv --table sellers
 #
 #   # Run pytest tests:
-#   pytest part3_etl_pipeline.py -v
+#   pytest part3_etl_pipeline.py test_part3_etl_pipeline.py -v
 #
 #-----------------------------------------------------
 
 
 from __future__ import annotations
 import argparse, json, logging, sqlite3, sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
 try:
@@ -43,12 +48,19 @@ try:
 except ImportError:
     pytest = None
 
+# Optional: multithreaded pyarrow CSV parser for whole-file reads, falls back to the C engine
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
 # --------------------------------------------------
 # 3.5 — LOGGING & MONITORING CONFIGURATION
 # --------------------------------------------------
 # Structured logging with both file and console output.
 # Format: "YYYY-MM-DD HH:MM:SS | LEVEL | [OPERATION] message"
-# Operations: [LOAD], [OK], [ERROR], [FK], [FK-CHECK], [auto_fix]
+# Operations: [LOAD], [OK], [ERROR], [FK], [FK-CHECK], [auto_fix], [MIGRATE]
 # Levels: DEBUG, INFO, WARNING, ERROR
 #
 logging.basicConfig(
@@ -74,6 +86,9 @@ log = logging.getLogger("ETL")
 #   dates    : Columns to parse as datetime
 #   fks      : Tuples of (local_col, parent_table, parent_col)
 #   all      : All expected columns (for schema alignment)
+#   key      : Columns that uniquely identify a row (upsert conflict target);
+#              only set where pk is not unique, otherwise defaults to [pk]
+#   categorical : Low-cardinality text columns held as pandas category after validation
 #
 SCHEMAS = {
     "sellers": {
@@ -83,6 +98,7 @@ SCHEMAS = {
         "dates": ["signup_date"],
         "fks": [],
         "all": ["seller_id", "seller_name", "market", "signup_date", "credit_limit", "avg_weekly_leads", "initial_wallet", "am_id", "sam_id"],
+        "categorical": ["market"],
     },
     "credits": {
         "pk": "credit_id",
@@ -91,6 +107,7 @@ SCHEMAS = {
         "dates": ["issue_date", "due_date"],
         "fks": [("seller_id", "sellers", "seller_id")],
         "all": ["credit_id", "seller_id", "amount", "issue_date", "due_date", "status"],
+        "categorical": ["status"],
     },
     "leads": {
         "pk": "lead_id",
@@ -99,6 +116,7 @@ SCHEMAS = {
         "dates": ["created_at"],
         "fks": [("seller_id", "sellers", "seller_id")],
         "all": ["lead_id", "seller_id", "created_at", "amount", "status", "shipping_status", "tracking_number"],
+        "categorical": ["status", "shipping_status"],
     },
     "invoices": {
         "pk": "invoice_id",
@@ -115,6 +133,8 @@ SCHEMAS = {
         "dates": [],
         "fks": [("invoice_id", "invoices", "invoice_id")],
         "all": ["invoice_id", "item_type", "amount"],
+        "key": ["invoice_id", "item_type"],
+        "categorical": ["item_type"],
     },
     "account_managers": {
         "pk": "am_id",
@@ -139,6 +159,7 @@ SCHEMAS = {
         "dates": ["created_at"],
         "fks": [("seller_id", "sellers", "seller_id")],
         "all": ["transaction_id", "seller_id", "type", "amount", "created_at"],
+        "categorical": ["type"],
     },
     "credit_histories": {
         "pk": "credit_id", 
@@ -147,6 +168,8 @@ SCHEMAS = {
         "dates": ["changed_at"],
         "fks": [("credit_id", "credits", "credit_id")],
         "all": ["credit_id", "status", "changed_at"],
+        "key": ["credit_id", "status", "changed_at"],
+        "categorical": ["status"],
     },
     "credit_chat": {
         "pk": "credit_id",  
@@ -155,18 +178,136 @@ SCHEMAS = {
         "dates": ["message_time"],
         "fks": [("credit_id", "credits", "credit_id")],
         "all": ["credit_id", "user_id", "role", "message_time", "message"],
+        "key": ["credit_id", "user_id", "message_time"],
+        "categorical": ["role"],
     },
 }
 
 
+# Surrogate id column per table; a CSV "id" column is renamed to it, or it is generated
+ID_COLUMNS = {
+    "invoice_items": "invoice_item_id",
+    "wallet_transactions": "wallet_id",
+    "credit_histories": "credit_history_id",
+    "credit_chat": "chat_id"
+}
+
+# Bound parameters per statement (SQLite's historical SQLITE_MAX_VARIABLE_NUMBER default)
+SQLITE_MAX_PARAMS = 999
+# Rows per CSV chunk streamed through load_data()
+CSV_CHUNKSIZE = 100_000
+# Per-row content hash stored next to the data, so detect_changes() only fetches (pk, row_hash)
+ROW_HASH_COL = "row_hash"
+# Below this many stored rows detect_changes() classifies with a dict lookup instead of a merge
+SMALL_TABLE_ROWS = 10_000
+# Loads of at least this many rows (and more rows than the table holds) drop the table's
+# secondary indexes and rebuild them once before COMMIT instead of updating them per row
+INDEX_REBUILD_MIN_ROWS = 10_000
+
+
+def row_hashes(df: pd.DataFrame, table: str) -> np.ndarray:
+    """Signed 64-bit hash of each row's schema columns, in schema order (CSV column order doesn't matter)."""
+    cols = [c for c in TABLES[table].columns if c in df.columns]
+    return pd.util.hash_pandas_object(df[cols], index=False).to_numpy().view(np.int64)
+
+
+def key_hashes(df: pd.DataFrame, table: str) -> np.ndarray:
+    """64-bit hash of each row's upsert key, to spot rows of one load that share a key."""
+    return pd.util.hash_pandas_object(df[list(TABLES[table].key)], index=False).to_numpy()
+
+
+@lru_cache(maxsize=None)
+def upsert_sql(table: str, cols: tuple[str, ...], n_rows: int = 1) -> str:
+    """
+    Build the parameterized upsert for `cols` of `table`, with `n_rows` VALUES tuples
+    (memoized, so `cols` must be a tuple).
+
+    INSERT ... ON CONFLICT(key) DO UPDATE only rewrites a conflicting row when it differs,
+    so identical rows count as no change (idempotent re-runs). With a row_hash column the
+    engine compares that single value; otherwise it compares every non-key column.
+    """
+    schema = SCHEMAS[table]
+    key = schema.get("key", [schema["pk"]])
+    row = "(" + ", ".join("?" * len(cols)) + ")"
+    sql = (f"INSERT INTO {table} ({', '.join(cols)}) VALUES {', '.join([row] * n_rows)} "
+           f"ON CONFLICT({', '.join(key)}) ")
+    set_cols = [c for c in cols if c not in key]
+    if not set_cols:
+        return sql + "DO NOTHING"
+    sql += "DO UPDATE SET " + ", ".join(f"{c}=excluded.{c}" for c in set_cols)
+    if ROW_HASH_COL in set_cols:
+        return sql + f" WHERE {table}.{ROW_HASH_COL} IS NOT excluded.{ROW_HASH_COL}"
+    return (sql + f" WHERE ({', '.join(f'{table}.{c}' for c in set_cols)})"
+            + f" IS NOT ({', '.join(f'excluded.{c}' for c in set_cols)})")
+
+
+@dataclass(frozen=True, slots=True)
+class TableSpec:
+    """One SCHEMAS entry resolved once at import: column tuples plus the SQL load_data() runs."""
+    name: str
+    pk: str
+    key: tuple[str, ...]
+    required: tuple[str, ...]
+    columns: tuple[str, ...]
+    column_set: frozenset[str]
+    id_column: str | None
+    read_col_set: frozenset[str]
+    categorical: tuple[str, ...]
+    fks: tuple[tuple[str, str, str], ...]
+    fk_cols: tuple[str, ...]
+    create_sql: str
+    fk_index_sqls: tuple[str, ...]
+    key_index_sql: str
+    count_sql: str
+    select_hash_sql: str
+    rows_per_stmt: int
+    upsert_sql: str
+
+    @classmethod
+    def from_schema(cls, name: str, schema: dict) -> TableSpec:
+        columns = tuple(schema["all"])
+        key = tuple(schema.get("key", [schema["pk"]]))
+        load_cols = columns + (ROW_HASH_COL,)
+        rows_per_stmt = max(1, SQLITE_MAX_PARAMS // len(load_cols))
+        return cls(
+            name=name,
+            pk=schema["pk"],
+            key=key,
+            required=tuple(schema["required"]),
+            columns=columns,
+            column_set=frozenset(columns),
+            id_column=ID_COLUMNS.get(name),
+            # Columns _fix_schema() can use (schema + id alias), passed to read_csv as usecols
+            read_col_set=frozenset(columns) | ({"id", ID_COLUMNS[name]} if name in ID_COLUMNS else set()),
+            categorical=tuple(schema.get("categorical", [])),
+            fks=tuple(schema["fks"]),
+            fk_cols=tuple(c for c, _, _ in schema["fks"]),
+            create_sql=(f"CREATE TABLE IF NOT EXISTS {name} "
+                        f"({', '.join(f'{c} TEXT' for c in columns)}, {ROW_HASH_COL} INTEGER, "
+                        f"PRIMARY KEY ({', '.join(key)}))"),
+            # FK columns not already leading the key index
+            fk_index_sqls=tuple(f"CREATE INDEX IF NOT EXISTS ix_{name}_{c} ON {name} ({c})"
+                                for c, _, _ in schema["fks"] if c != key[0]),
+            key_index_sql=f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name}_key ON {name} ({', '.join(key)})",
+            count_sql=f"SELECT COUNT(*) FROM {name}",
+            select_hash_sql=f"SELECT {', '.join(f'CAST({c} AS TEXT)' for c in key)}, {ROW_HASH_COL} FROM {name}",
+            rows_per_stmt=rows_per_stmt,
+            upsert_sql=upsert_sql(name, load_cols, rows_per_stmt),
+        )
+
+
+# Precompiled per-table specs (SCHEMAS stays the editable source of truth)
+TABLES = {name: TableSpec.from_schema(name, schema) for name, schema in SCHEMAS.items()}
+
+
 # --------------------------------------------------
 # 3.1 — INCREMENTAL ETL CLASS (MAIN PIPELINE)
 # --------------------------------------------------
 # Core class implementing the 4-method design pattern:
 #   1. validate_schema()    : Verify CSV structure & auto-fix issues
-#   2. detect_changes()     : Identify new vs updated vs duplicate records (idempotent)
-#   3. load_data()          : Execute INSERT/UPDATE with atomic transaction handling
-#   4. _conn()              : Manage database connections with PRAGMA foreign_keys ON
+#   2. detect_changes()     : Identify new vs updated vs duplicate records (explicit classification)
+#   3. load_data()          : Execute INSERT ... ON CONFLICT DO UPDATE with atomic transaction handling
+#   4. _conn()              : Manage database connections (foreign_keys ON, WAL + bulk-load PRAGMAs)
 #
 # Design principles:
 #   - Idempotency: Can run same file multiple times without duplicates
@@ -177,13 +318,114 @@ class IncrementalETL:
     def __init__(self, db_path: Path):
         self.db_path = Path(db_path)
         self.summary = {}
+        self._shared_conn = None
+
+    @contextmanager
+    def shared_connection(self):
+        """
+        Route every load_data() call made inside the block through one long-lived connection
+        (PRAGMAs applied once, statement cache kept across tables). Each table then runs in
+        its own SAVEPOINT.
+        """
+        conn = self._conn()
+        self._shared_conn = conn
+        try:
+            yield conn
+        finally:
+            self._shared_conn = None
+            conn.close()
 
     def _conn(self):
-        """Create SQLite connection with PRAGMA foreign_keys enabled for referential integrity."""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Create SQLite connection with PRAGMA foreign_keys enabled for referential integrity,
+        tuned for bulk loads: WAL journal with NORMAL sync (no fsync per commit), in-memory
+        temp store, 64 MB page cache and 256 MB memory-mapped I/O. A larger statement cache
+        keeps the fixed-size upsert (and per-table probe) statements prepared across chunks.
+        """
+        # isolation_level=None: no implicit BEGIN from the sqlite3 module; transactions are the
+        # explicit BEGIN / SAVEPOINT in _load() (an implicit outer BEGIN would also
+        # swallow the per-table SAVEPOINTs of a shared connection)
+        conn = sqlite3.connect(self.db_path, cached_statements=256, isolation_level=None)
         conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA cache_size = -65536;")
+        conn.execute("PRAGMA mmap_size = 268435456;")
         return conn
 
+    def _ensure_table(self, conn, table):
+        """
+        Create the table if absent, with the key declared as PRIMARY KEY (upsert conflict
+        target) and an index on each FK column. Tables that predate this (or come from
+        create_tables.py) get the row_hash column added (and backfilled, see _backfill_row_hash)
+        and, if their PK is not the key, a UNIQUE index on the key columns.
+        """
+        spec = TABLES[table]
+        info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        if not info:
+            conn.execute(spec.create_sql)
+            for sql in spec.fk_index_sqls:
+                conn.execute(sql)
+            return
+        if ROW_HASH_COL not in [r[1] for r in info]:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {ROW_HASH_COL} INTEGER")
+            self._backfill_row_hash(conn, table, [r[1] for r in info])
+        pk_cols = tuple(r[1] for r in sorted(info, key=lambda r: r[5]) if r[5])
+        if pk_cols != spec.key:
+            conn.execute(spec.key_index_sql)
+
+    def _backfill_row_hash(self, conn, table, db_cols: list[str]):
+        """
+        Fill the just-added row_hash of existing rows, hashing their values read back as text
+        (NULL as "") the way load_data() hashes CSV rows, so an unchanged re-load skips them
+        instead of rewriting the whole table.
+        """
+        cols = [c for c in TABLES[table].columns if c in db_cols]
+        cur = conn.execute(f"SELECT rowid, {', '.join(f'CAST({c} AS TEXT)' for c in cols)} FROM {table}")
+        filled = 0
+        while rows := cur.fetchmany(CSV_CHUNKSIZE):
+            rowids, *values = zip(*rows)
+            df = pd.DataFrame({c: pd.array(v, dtype="str") for c, v in zip(cols, values)}).fillna("")
+            conn.executemany(f"UPDATE {table} SET {ROW_HASH_COL} = ? WHERE rowid = ?",
+                             zip(row_hashes(df, table).tolist(), rowids))
+            filled += len(rows)
+        if filled:
+            # Values SQLite converted on storage (e.g. a CSV "1500" kept as 1500.0 by a REAL column)
+            # don't read back as the CSV text, so those rows still hash differently and are rewritten once
+            log.warning(f"[MIGRATE] Added {ROW_HASH_COL} to {table} and backfilled {filled} rows; "
+                        f"rows whose stored values differ from the CSV text are rewritten once and "
+                        f"counted as updated on this run")
+
+    def _drop_secondary_indexes(self, conn, table) -> list[str]:
+        """Drop the non-unique CREATE INDEX indexes of `table`; returns their CREATE statements."""
+        names = [r[1] for r in conn.execute(f"PRAGMA index_list({table})") if not r[2] and r[3] == "c"]
+        sqls = []
+        for name in names:
+            sqls.append(conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()[0])
+            conn.execute(f"DROP INDEX {name}")
+        return sqls
+
+    def _upsert(self, conn, table, df):
+        """Upsert `df` (plus its row_hash) with multi-row VALUES statements sized to stay under SQLITE_MAX_PARAMS."""
+        spec = TABLES[table]
+        df = df.assign(**{ROW_HASH_COL: row_hashes(df, table)})
+        cols = tuple(df.columns)
+        if len(cols) == len(spec.columns) + 1:
+            # Every schema column present: schema order + the precompiled statement
+            cols = spec.columns + (ROW_HASH_COL,)
+            df = df[list(cols)]
+            rows_per_stmt, full_sql = spec.rows_per_stmt, spec.upsert_sql
+        else:
+            rows_per_stmt = max(1, SQLITE_MAX_PARAMS // len(cols))
+            full_sql = upsert_sql(table, cols, rows_per_stmt)
+        # Plain object arrays: itertuples() would step through the str/category extension arrays
+        # one element at a time
+        rows = zip(*(df[c].to_numpy(dtype=object) for c in cols))
+        while chunk := list(islice(rows, rows_per_stmt)):
+            sql = full_sql if len(chunk) == rows_per_stmt else upsert_sql(table, cols, len(chunk))
+            conn.execute(sql, [v for row in chunk for v in row])
+
     def _log(self, level, op, msg, rid=None):
         """Structured logging with operation prefix."""
         getattr(log, level.lower())(f"[{op}] id={rid} | {msg}")
@@ -198,93 +440,150 @@ class IncrementalETL:
         3. Generate missing PK columns (for items/histories/chat tables)
         4. Validate all required columns are present
         5. Return only expected columns in schema order
+        6. Hold the schema's low-cardinality columns as pandas category (codes, not strings)
         
         Raises ValueError if any required column is missing (after fixes).
         """
-        df = pd.read_csv(csv_file, dtype=str).fillna("")
+        df = pd.read_csv(csv_file, dtype=str, engine=CSV_ENGINE, usecols=self._read_cols(csv_file, table))
+        return self._fix_schema(df.fillna(""), table)
+
+    def _read_cols(self, csv_file: Path, table: str) -> list[str]:
+        """
+        Header names (as written in the CSV) that _fix_schema() can use: schema columns plus the
+        id alias. Passed as usecols so other columns are never parsed; a list, not a callable,
+        because the pyarrow engine only accepts lists.
+        """
+        keep = TABLES[table].read_col_set
+        return [c for c in pd.read_csv(csv_file, nrows=0).columns if c.strip().lower() in keep]
+
+    def validate_schema_chunks(self, csv_file: Path, table: str, chunksize: int = CSV_CHUNKSIZE):
+        """
+        Streaming variant of validate_schema(): yields validated chunks of at most `chunksize`
+        rows, so peak memory is bounded by the chunk size rather than the file size.
+        Uses the C engine: the pyarrow engine has no chunksize support.
+        """
+        reader = pd.read_csv(csv_file, dtype=str, chunksize=chunksize, engine="c", low_memory=False,
+                             usecols=self._read_cols(csv_file, table))
+        offset = 0
+        for chunk in reader:
+            yield self._fix_schema(chunk.fillna(""), table, offset)
+            offset += len(chunk)
+
+    def _fix_schema(self, df: pd.DataFrame, table: str, offset: int = 0) -> pd.DataFrame:
+        """Apply the validate_schema() auto-fixes to one frame; `offset` = rows already seen (chunked reads)."""
         df.columns = [c.strip().lower() for c in df.columns]
-        schema = SCHEMAS[table]
+        spec = TABLES[table]
 
-        id_map = {
-            "invoice_items": "invoice_item_id",
-            "wallet_transactions": "wallet_id",
-            "credit_histories": "credit_history_id",
-            "credit_chat": "chat_id"
-        }
-        if table in id_map:
-            expected_id = id_map[table]
+        expected_id = spec.id_column
+        if expected_id:
             if "id" in df.columns and expected_id not in df.columns:
                 df.rename(columns={"id": expected_id}, inplace=True)
-                log.info(f"[auto_fix] Renamed id → {expected_id} for {table}")
+                if offset == 0:
+                    log.info(f"[auto_fix] Renamed id → {expected_id} for {table}")
             if expected_id not in df.columns:
-                df.insert(0, expected_id, range(1, len(df)+1))
-                log.warning(f"[auto_fix] Generated missing PK column {expected_id} for {table}")
-
-        missing = [c for c in schema["required"] if c not in df.columns]
+                # Only materialized if the schema keeps it; otherwise the projection below drops it
+                if expected_id in spec.column_set:
+                    df.insert(0, expected_id, range(offset + 1, offset + len(df) + 1))
+                    if offset == 0:
+                        log.warning(f"[auto_fix] Generated missing PK column {expected_id} for {table}")
+                elif offset == 0:
+                    log.info(f"[auto_fix] Skipped missing {expected_id} for {table} (not a schema column)")
+
+        missing = [c for c in spec.required if c not in df.columns]
         if missing:
             raise ValueError(f"{table}: missing required columns {missing}")
-        return df[[c for c in df.columns if c in schema["all"]]].copy()
+        df = df[[c for c in df.columns if c in spec.column_set]].copy()
+        for c in spec.categorical:
+            if c in df.columns:
+                df[c] = df[c].astype("category")
+        return df
 
     def detect_changes(self, csv_file, table):
         """
         3.3 — IDEMPOTENCY: Change detection via merge
         
-        Identifies new vs updated vs duplicate records using left-join merge on primary key:
+        Identifies new vs updated vs duplicate records using left-join merge on the row key
+        (the primary key, or the composite "key" of tables whose pk repeats):
         - new_df     : Records in CSV but not in database (INSERT)
         - upd_df     : Records in both where values differ (UPDATE)
         - dup_df     : Records in both with identical values (SKIP)
         
         Strategy:
-        1. Load CSV and convert all to strings for consistent comparison
-        2. Load existing records from database (or empty DataFrame if table doesn't exist)
-        3. Left-merge on PK with suffixes ("", "_db") to identify differences
+        1. Load CSV as strings (validate_schema) for consistent comparison
+        2. Load existing (key, row_hash) pairs from database (nothing if table doesn't exist)
+        3. Hash each CSV row the same way load_data() stored it and left-merge the DB hashes on
+           the key, validated many-to-one (a DB key matching several rows raises MergeError);
+           tables under SMALL_TABLE_ROWS use a {key: hash} dict lookup instead
         4. Use _merge indicator to classify: "left_only" (new), "both" (existing)
-        5. For "both", compare all columns to detect updates vs duplicates
+        5. For "both", compare the row hashes to detect updates vs duplicates
         
         This ensures running twice with same CSV doesn't create duplicates (idempotent).
+        load_data() no longer needs this (SQLite resolves conflicts itself); it is kept for
+        callers that want the new/updated/duplicate rows as DataFrames.
         """
         df = self.validate_schema(csv_file, table)
-        schema = SCHEMAS[table]
-        pk = schema["pk"]
-
-        # Always ensure PK is string to avoid merge dtype mismatches
-        df[pk] = df[pk].astype(str)
+        spec = TABLES[table]
+        key = list(spec.key)
 
+        # Only (key, row_hash) is read back; rows loaded before row_hash existed hash as NULL (= changed).
+        # Key columns are cast to TEXT by SQLite so both merge keys are native string arrays (CSV is
+        # read as str already) without a per-value Python str() pass.
+        rows = []
         with self._conn() as conn:
-            try:
-                existing = pd.read_sql_query(f"SELECT * FROM {table}", conn)
-                # Force existing PK to string type too
-                existing[pk] = existing[pk].astype(str)
-                existing = existing.astype(str).fillna("")
-            except Exception:
-                existing = pd.DataFrame(columns=df.columns).astype(str)
-
-        if existing.empty:
-            return df, pd.DataFrame(), pd.DataFrame()
+            db_cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+            if db_cols:
+                sql = (spec.select_hash_sql if ROW_HASH_COL in db_cols else
+                       f"SELECT {', '.join(f'CAST({c} AS TEXT)' for c in key)}, NULL FROM {table}")
+                rows = conn.execute(sql).fetchall()
 
-        merged = df.merge(existing, on=pk, how="left", suffixes=("", "_db"), indicator=True)
+        if not rows:
+            return df, pd.DataFrame(), pd.DataFrame()
 
-        new_df = merged[merged["_merge"] == "left_only"][df.columns]
-        diff = pd.concat(
-            [(merged[c] != merged.get(f"{c}_db", merged[c])) for c in df.columns if c != pk],
-            axis=1
-        ).any(axis=1)
-        upd_df = merged[(merged["_merge"] == "both") & diff][df.columns]
-        dup_df = merged[(merged["_merge"] == "both") & (~diff)][df.columns]
+        if len(rows) < SMALL_TABLE_ROWS:
+            # Small table: dict lookup {key tuple: hash}, cheaper than building frames to merge
+            existing = {r[:-1]: r[-1] for r in rows}
+            missing = object()
+            found = [existing.get(k, missing) for k in zip(*(df[c] for c in key))]
+            both = np.fromiter((h is not missing for h in found), bool, len(found))
+            diff = np.fromiter((h_db != h for h_db, h in zip(found, row_hashes(df, table).tolist())), bool, len(found))
+        else:
+            # Nullable Int64 keeps the 64-bit hashes exact (no float64 upcast for NULLs / unmatched rows)
+            *key_values, hashes = zip(*rows)
+            existing = pd.DataFrame({c: pd.array(v, dtype="str") for c, v in zip(key, key_values)})
+            existing["_h_db"] = pd.array(hashes, dtype="Int64")
+            merged = df.assign(_h=row_hashes(df, table)).merge(
+                existing, on=key, how="left", indicator=True, validate="many_to_one")
+            # The left merge is many-to-one, so merged rows line up 1:1 with df
+            both = (merged["_merge"] == "both").to_numpy()
+            diff = merged["_h_db"].ne(merged["_h"]).to_numpy(dtype=bool, na_value=True)
+
+        # Plain NumPy bool masks over df; a NULL/missing DB hash counts as different
+        new_df = df[~both]
+        upd_df = df[both & diff]
+        dup_df = df[both & ~diff]
         return new_df, upd_df, dup_df
 
 
-    def load_data(self, csv_file, table):
+    def load_data(self, csv_file, table, fk_validator: ForeignKeyValidator | None = None):
         """
         3.4 — TRANSACTION MANAGEMENT: Atomic load with rollback
         
         Loads data for a single table with proper transaction handling:
-        1. Detect changes (new/updated/duplicates)
-        2. BEGIN transaction
-        3. INSERT new records via pandas.to_sql(mode='append')
-        4. UPDATE changed records via executemany with parameterized SQL
-        5. COMMIT on success, ROLLBACK on error
+        1. BEGIN transaction, or SAVEPOINT inside shared_connection() (creating the table /
+           key index if needed)
+        2. Stream the CSV in validated chunks (CSV_CHUNKSIZE rows; no full read of the
+           file or of the existing table)
+        3. UPSERT each chunk in multi-row VALUES batches: INSERT ... ON CONFLICT(key) DO UPDATE,
+           where the update only fires if the stored row_hash differs. Large loads into small
+           tables drop secondary indexes first and rebuild them before COMMIT. A file in which
+           two rows share a key is rejected (rolled back) rather than merged into one row
+        4. Derive counters: inserted = row-count delta, updated = remaining changes,
+           skipped = rows SQLite left untouched (duplicates)
+        5. COMMIT on success (deferred FK constraints are enforced here), ROLLBACK on error
         6. Log results with operation counters and timestamp
+        7. If `fk_validator` is given, check the distinct FK values seen while streaming
+           (no second parse of the CSV) against the parent tables in the database and
+           attach any issues as fk_warnings
         
         All changes for one table are atomic: either all succeed or all rollback.
         Logs structured output: [LOAD] [OK] COMMIT | table=X | +N inserted | updated=M | skipped=K
@@ -296,32 +595,88 @@ class IncrementalETL:
         if not Path(csv_file).exists():
             log.warning(f"[SKIP] Missing file {csv_file}")
             return None
-        new_df, upd_df, dup_df = self.detect_changes(csv_file, table)
+        if self._shared_conn is not None:
+            return self._load(self._shared_conn, csv_file, table, fk_validator, savepoint=True)
         conn = self._conn()
-        conn.execute("BEGIN")
         try:
-            if not new_df.empty:
-                new_df.to_sql(table, conn, if_exists="append", index=False)
-            if not upd_df.empty:
-                pk = SCHEMAS[table]["pk"]
-                cols = [c for c in upd_df.columns if c != pk]
-                sql = f"UPDATE {table} SET " + ", ".join([f"{c}=?" for c in cols]) + f" WHERE {pk}=?"
-                conn.executemany(sql, [tuple([*(r[c] for c in cols), r[pk]]) for _, r in upd_df.iterrows()])
-            conn.commit()
-            log.info(f"[OK] COMMIT | table={table} | +{len(new_df)} | updated={len(upd_df)} | skipped={len(dup_df)}")
-            return {
+            return self._load(conn, csv_file, table, fk_validator)
+        finally:
+            conn.close()
+
+    def _load(self, conn, csv_file, table, fk_validator=None, savepoint=False):
+        """Body of load_data() on an open connection: one transaction, or one SAVEPOINT on a shared connection."""
+        if savepoint:
+            conn.execute(f"SAVEPOINT tbl_{table}")
+        else:
+            conn.execute("BEGIN")
+        # Declared FK constraints (if the target schema has any) are checked once at COMMIT
+        # instead of per row; the pragma resets itself when the transaction ends
+        conn.execute("PRAGMA defer_foreign_keys = ON;")
+        try:
+            self._ensure_table(conn, table)
+            spec = TABLES[table]
+            rows_before = conn.execute(spec.count_sql).fetchone()[0]
+            changes_before = conn.total_changes
+            records = 0
+            fk_keys = []
+            seen_keys = []
+            rebuild = None
+            for df in self.validate_schema_chunks(csv_file, table):
+                if rebuild is None:
+                    # Decided on the first chunk (unique key indexes always stay for the upsert);
+                    # every chunk of a file has the same columns
+                    big = len(df) >= INDEX_REBUILD_MIN_ROWS and len(df) > rows_before
+                    rebuild = self._drop_secondary_indexes(conn, table) if big else []
+                    fk_cols = [c for c in spec.fk_cols if c in df.columns] if fk_validator is not None else []
+                self._upsert(conn, table, df)
+                seen_keys.append(key_hashes(df, table))
+                records += len(df)
+                if fk_cols:
+                    fk_keys.append(df[fk_cols].drop_duplicates())
+            # ON CONFLICT would fold rows sharing a key into one; a source with repeated keys is
+            # rejected instead (the whole load rolls back)
+            if seen_keys:
+                all_keys = np.concatenate(seen_keys)
+                repeated = len(all_keys) - len(np.unique(all_keys))
+                if repeated:
+                    raise ValueError(f"{table}: {repeated} rows repeat the key ({', '.join(spec.key)}) of another row")
+            for sql in rebuild or []:
+                conn.execute(sql)
+            changed = conn.total_changes - changes_before
+            inserted = conn.execute(spec.count_sql).fetchone()[0] - rows_before
+            updated, skipped = changed - inserted, records - changed
+            if savepoint:
+                conn.execute(f"RELEASE tbl_{table}")
+            else:
+                conn.commit()
+            log.info(f"[OK] COMMIT | table={table} | +{inserted} | updated={updated} | skipped={skipped}")
+            result = {
                 "table": table,
-                "inserted": len(new_df),
-                "updated": len(upd_df),
-                "skipped": len(dup_df),
-                "records": len(new_df)+len(upd_df)+len(dup_df)
+                "inserted": inserted,
+                "updated": updated,
+                "skipped": skipped,
+                "records": records
             }
         except Exception as e:
-            conn.rollback()
+            if savepoint:
+                conn.execute(f"ROLLBACK TO tbl_{table}")
+                conn.execute(f"RELEASE tbl_{table}")
+            else:
+                conn.rollback()
             log.error(f"[ERROR] Rollback {table}: {e}")
             return {"table": table, "error": str(e)}
-        finally:
-            conn.close()
+
+        #  FK validation warning (against the parent tables as committed so far)
+        try:
+            if fk_validator is not None and fk_keys:
+                fk_issues = fk_validator.validate_foreign_keys_db(conn, pd.concat(fk_keys).drop_duplicates(), table)
+                if fk_issues:
+                    result["fk_warnings"] = fk_issues
+                    for msg in fk_issues:
+                        log.warning(f"[FK-CHECK] {table}: {msg}")
+        except Exception as e:
+            log.warning(f"[FK-CHECK] Skipped for {table}: {e}")
+        return result
 
 
 # --------------------------------------------------
@@ -345,35 +700,49 @@ class ForeignKeyValidator:
     """Optional helper to cross-check foreign key integrity before load."""
     def __init__(self, existing_data: dict[str, pd.DataFrame]):
         self.existing_data = existing_data
+        self._cache: dict[tuple[str, str], frozenset] = {}
+
+    def _valid_ids(self, parent_tbl: str, parent_col: str) -> frozenset:
+        """Referenced key values of parent_tbl.parent_col as strings, built once per run."""
+        key = (parent_tbl, parent_col)
+        if key not in self._cache:
+            parent = self.existing_data.get(parent_tbl, pd.DataFrame())
+            self._cache[key] = frozenset(parent.get(parent_col, pd.Series()).dropna().astype(str))
+        return self._cache[key]
 
     def validate_foreign_keys(self, df: pd.DataFrame, table_name: str) -> list[str]:
-        """Validate foreign key references against existing data."""
+        """Validate foreign key references (SCHEMAS fks) against existing data."""
         issues = []
-        
-        if table_name == "credits" and "seller_id" in df.columns:
-            valid_ids = set(self.existing_data.get("sellers", pd.DataFrame()).get("seller_id", pd.Series()).dropna().astype(str).unique())
-            invalid = df.loc[~df["seller_id"].astype(str).isin(valid_ids), "seller_id"].unique().tolist()
-            if invalid:
-                issues.append(f"{len(invalid)} credits reference unknown sellers: {invalid[:5]}...")
-        
-        elif table_name == "invoices" and "seller_id" in df.columns:
-            valid_ids = set(self.existing_data.get("sellers", pd.DataFrame()).get("seller_id", pd.Series()).dropna().astype(str).unique())
-            invalid = df.loc[~df["seller_id"].astype(str).isin(valid_ids), "seller_id"].unique().tolist()
+        for local_col, parent_tbl, parent_col in TABLES[table_name].fks:
+            if local_col not in df.columns:
+                continue
+            valid_ids = self._valid_ids(parent_tbl, parent_col)
+            invalid = df.loc[~df[local_col].astype(str).isin(valid_ids), local_col].unique().tolist()
             if invalid:
-                issues.append(f"{len(invalid)} invoices reference unknown sellers: {invalid[:5]}...")
-        
-        elif table_name == "leads" and "seller_id" in df.columns:
-            valid_ids = set(self.existing_data.get("sellers", pd.DataFrame()).get("seller_id", pd.Series()).dropna().astype(str).unique())
-            invalid = df.loc[~df["seller_id"].astype(str).isin(valid_ids), "seller_id"].unique().tolist()
-            if invalid:
-                issues.append(f"{len(invalid)} leads reference unknown sellers: {invalid[:5]}...")
-        
-        elif table_name == "wallet_transactions" and "seller_id" in df.columns:
-            valid_ids = set(self.existing_data.get("sellers", pd.DataFrame()).get("seller_id", pd.Series()).dropna().astype(str).unique())
-            invalid = df.loc[~df["seller_id"].astype(str).isin(valid_ids), "seller_id"].unique().tolist()
+                issues.append(f"{len(invalid)} {table_name.replace('_', ' ')} reference unknown {parent_tbl}: {invalid[:5]}...")
+        return issues
+
+    def validate_foreign_keys_db(self, conn: sqlite3.Connection, df: pd.DataFrame, table_name: str) -> list[str]:
+        """
+        Same check as validate_foreign_keys(), run inside SQLite: the distinct local values go
+        into a temp table and are probed against the parent's key index, so no parent ids are
+        pulled into Python. A missing parent table means every value is unknown.
+        """
+        issues = []
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _fk_check (v TEXT)")
+        for local_col, parent_tbl, parent_col in TABLES[table_name].fks:
+            if local_col not in df.columns:
+                continue
+            conn.execute("DELETE FROM _fk_check")
+            conn.executemany("INSERT INTO _fk_check (v) VALUES (?)",
+                             ((v,) for v in df[local_col].astype(str).unique()))
+            sql = "SELECT v FROM _fk_check"
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (parent_tbl,)).fetchone():
+                sql += f" WHERE v NOT IN (SELECT {parent_col} FROM {parent_tbl})"
+            invalid = [v for (v,) in conn.execute(sql + " ORDER BY rowid")]
             if invalid:
-                issues.append(f"{len(invalid)} wallet transactions reference unknown sellers: {invalid[:5]}...")
-        
+                issues.append(f"{len(invalid)} {table_name.replace('_', ' ')} reference unknown {parent_tbl}: {invalid[:5]}...")
+        conn.execute("DROP TABLE _fk_check")
         return issues
 
 
@@ -401,8 +770,15 @@ def append_timestamp_to_summary(summary: list[dict]) -> list[dict]:
 #   test_validate_schema_required_fields        : Verify schema enforcement
 #   test_foreign_key_check_logs_warning         : Verify FK validator
 #
+# Load behaviour tests (temp SQLite file) live in test_part3_etl_pipeline.py:
+#   test_rerun_of_unchanged_file_is_skipped     : Unchanged rerun reports skipped
+#   test_modified_row_is_updated                : Changed row reports updated
+#   test_missing_required_column_rolls_back     : Rejected file leaves the table untouched
+#   test_repeated_key_rolls_back                : Repeated upsert key is rejected
+#   test_validate_fk_reports_orphan             : --validate-fk reports an orphan FK
+#
 # Run tests:
-#   pytest part3_etl_pipeline.py -v
+#   pytest part3_etl_pipeline.py test_part3_etl_pipeline.py -v
 #
 
 if pytest:
@@ -483,38 +859,21 @@ def main():
         ]
         results = []
 
-        #  this part is Optional: load existing data for FK validation
-        existing_data = {}
+        #  this part is Optional: FK validation of each loaded table
+        fk_validator = None
         if args.validate_fk:
             log.info("[FK] Foreign key validation enabled")
-            with etl._conn() as conn:
-                for table in order:
-                    try:
-                        existing_data[table] = pd.read_sql_query(f"SELECT * FROM {table}", conn).fillna("")
-                    except Exception:
-                        existing_data[table] = pd.DataFrame()
-            fk_validator = ForeignKeyValidator(existing_data)
+            # Parent keys are probed in SQLite by load_data(); nothing is preloaded
+            fk_validator = ForeignKeyValidator({})
         
-        for table in order:
-            file = args.run_all / f"{table}.csv"
-            if file.exists():
-                result = etl.load_data(file, table)
-                
-                #  FK validation warning
-                if args.validate_fk and result and "error" not in result:
-                    try:
-                        df = etl.validate_schema(file, table)
-                        fk_issues = fk_validator.validate_foreign_keys(df, table)
-                        if fk_issues:
-                            result["fk_warnings"] = fk_issues
-                            for msg in fk_issues:
-                                log.warning(f"[FK-CHECK] {table}: {msg}")
-                    except Exception as e:
-                        log.warning(f"[FK-CHECK] Skipped for {table}: {e}")
-                
-                results.append(result)
-            else:
-                log.warning(f"Skipping missing {file}")
+        # All tables load through one connection, each in its own SAVEPOINT
+        with etl.shared_connection():
+            for table in order:
+                file = args.run_all / f"{table}.csv"
+                if file.exists():
+                    results.append(etl.load_data(file, table, fk_validator))
+                else:
+                    log.warning(f"Skipping missing {file}")
         
         # for adding  timestamps to summary
         results = append_timestamp_to_summary(results)
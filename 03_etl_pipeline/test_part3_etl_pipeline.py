@@ -0,0 +1,92 @@
+"""
+Behaviour tests for the Part 3 incremental load against a temporary SQLite file.
+
+Run from the repository root or this folder:
+    pytest 03_etl_pipeline -v
+
+The fixtures and unit tests kept inside part3_etl_pipeline.py run with
+    pytest part3_etl_pipeline.py test_part3_etl_pipeline.py -v
+"""
+import json
+import sqlite3
+import sys
+
+import pytest
+
+SELLERS = "seller_id,seller_name,market\n1,Alpha,AFRQ\n2,Beta,AFRQ\n"
+CREDITS = "credit_id,seller_id,amount\n101,1,500\n102,9,250\n"
+
+
+@pytest.fixture
+def etl(tmp_path, monkeypatch):
+    """The pipeline module, imported with tmp_path as cwd (it opens etl_execution.log there)."""
+    monkeypatch.chdir(tmp_path)
+    import part3_etl_pipeline
+    return part3_etl_pipeline
+
+
+def write_csv(path, text):
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def rows(db, table):
+    with sqlite3.connect(db) as conn:
+        return conn.execute(f"SELECT seller_id, seller_name, market FROM {table} ORDER BY seller_id").fetchall()
+
+
+def test_rerun_of_unchanged_file_is_skipped(etl, tmp_path):
+    """Test: a second load of the same CSV inserts nothing and reports every row skipped."""
+    db, csv = tmp_path / "etl.db", write_csv(tmp_path / "sellers.csv", SELLERS)
+    first = etl.IncrementalETL(db).load_data(csv, "sellers")
+    second = etl.IncrementalETL(db).load_data(csv, "sellers")
+    assert (first["inserted"], first["updated"], first["skipped"]) == (2, 0, 0)
+    assert (second["inserted"], second["updated"], second["skipped"]) == (0, 0, 2)
+    assert len(rows(db, "sellers")) == 2
+
+
+def test_modified_row_is_updated(etl, tmp_path):
+    """Test: a changed value is reported as one update, the other row as skipped."""
+    db, csv = tmp_path / "etl.db", write_csv(tmp_path / "sellers.csv", SELLERS)
+    etl.IncrementalETL(db).load_data(csv, "sellers")
+    write_csv(csv, SELLERS.replace("Beta", "Beta Ltd"))
+    result = etl.IncrementalETL(db).load_data(csv, "sellers")
+    assert (result["inserted"], result["updated"], result["skipped"]) == (0, 1, 1)
+    assert rows(db, "sellers")[1][1] == "Beta Ltd"
+
+
+def test_missing_required_column_rolls_back(etl, tmp_path):
+    """Test: a file without a required column is rejected and the stored rows stay as they were."""
+    db, csv = tmp_path / "etl.db", write_csv(tmp_path / "sellers.csv", SELLERS)
+    etl.IncrementalETL(db).load_data(csv, "sellers")
+    before = rows(db, "sellers")
+    write_csv(csv, "seller_id,seller_name\n1,Changed\n3,Gamma\n")
+    result = etl.IncrementalETL(db).load_data(csv, "sellers")
+    assert "market" in result["error"]
+    assert rows(db, "sellers") == before
+
+
+def test_repeated_key_rolls_back(etl, tmp_path):
+    """Test: two rows sharing the composite key are rejected instead of merged into one."""
+    db = tmp_path / "etl.db"
+    csv = write_csv(tmp_path / "credit_histories.csv",
+                    "credit_id,status,changed_at\n101,approved,2024-01-01\n101,approved,2024-01-01\n")
+    result = etl.IncrementalETL(db).load_data(csv, "credit_histories")
+    assert "repeat the key" in result["error"]
+    with sqlite3.connect(db) as conn:
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'credit_histories'").fetchone()
+
+
+def test_validate_fk_reports_orphan(etl, tmp_path, monkeypatch):
+    """Test: --run-all --validate-fk attaches a warning for a credit whose seller is unknown."""
+    data = tmp_path / "dataset"
+    data.mkdir()
+    write_csv(data / "sellers.csv", SELLERS)
+    write_csv(data / "credits.csv", CREDITS)
+    monkeypatch.setattr(sys, "argv", ["part3_etl_pipeline.py", "--db", str(tmp_path / "etl.db"),
+                                      "--run-all", str(data), "--validate-fk"])
+    etl.main()
+    summary = {r["table"]: r for r in json.loads((tmp_path / "etl_load_summary.json").read_text(encoding="utf-8"))}
+    assert "fk_warnings" not in summary["sellers"]
+    assert summary["credits"]["inserted"] == 2
+    assert summary["credits"]["fk_warnings"] == ["1 credits reference unknown sellers: ['9']..."]
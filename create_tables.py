@@ -100,18 +100,34 @@ schema_statements = {
         item_type TEXT,
         amount REAL
     );
+    """,
+    # Secondary indexes on the join/filter columns used by the analysis
+    "indexes": """
+    CREATE INDEX IF NOT EXISTS idx_credits_seller ON credits(seller_id);
+    CREATE INDEX IF NOT EXISTS idx_credits_status ON credits(status);
+    CREATE INDEX IF NOT EXISTS idx_leads_seller ON leads(seller_id);
+    CREATE INDEX IF NOT EXISTS idx_leads_status ON leads(status);
+    CREATE INDEX IF NOT EXISTS idx_sellers_am ON sellers(am_id);
+    CREATE INDEX IF NOT EXISTS idx_wallet_transactions_seller ON wallet_transactions(seller_id);
+    CREATE INDEX IF NOT EXISTS idx_invoices_seller ON invoices(seller_id);
     """
 }
 
-# Connect to SQLite DB and execute schema
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
+# Connect to SQLite DB and execute schema (transactions are managed explicitly below)
+conn = sqlite3.connect(db_path, isolation_level=None)
+conn.execute("PRAGMA journal_mode=WAL")
+conn.execute("PRAGMA synchronous=NORMAL")
+conn.execute("PRAGMA temp_store=MEMORY")
+conn.execute("PRAGMA cache_size=-64000")
 
+# One transaction for the whole schema: a single journal sync instead of one per table
+conn.execute("BEGIN")
 for table_name, ddl in schema_statements.items():
-    print(f"Creating table: {table_name}")
-    cursor.execute(ddl)
-
-conn.commit()
+    for statement in ddl.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    print("Creating indexes" if table_name == "indexes" else f"Creating table: {table_name}")
+conn.execute("COMMIT")
 conn.close()
 
 print(f"\n✅ Database created at: {db_path}")